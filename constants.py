@@ -1,4 +1,5 @@
 """Define important constants used throughout the pipeline."""
+import numpy as np
 
 
 class preProc(object):
@@ -7,12 +8,14 @@ class preProc(object):
     Attributes:
         DIM_OUTSIDE_VAL (float): HU value to set voxels outside of mask to
         MEDFILT_KERNEL_SIZE (int): size of moving window for median filtering of images
+        MEDFILT_SLAB_SIZE (int): number of slices median filtered at a time, bounds temporary memory
         EXCLUDE_VOX_LOWERTHRESH (float): HU value below which to exclude voxels from mask
         EXCLUDE_VOX_UPPERTHRESH (float): HU value above which to exclude voxels from mask
     """
 
     DIM_OUTSIDE_VAL = -2000
     MEDFILT_KERNEL_SIZE = 3
+    MEDFILT_SLAB_SIZE = 16
     EXCLUDE_VOX_LOWERTHRESH = -1000
     EXCLUDE_VOX_UPPERTHRESH = -500
 
@@ -27,7 +30,7 @@ class proc(object):
         PRM_NUM_FSAD (int): number assigned to PRM fSAD voxels in combined PRM map
         PRM_NUM_EMPH (int): number assigned to PRM emph voxels in combined PRM map
         PRM_NUM_EMPTEMPH (int): number assigned to PRM emptying emph voxels in combined PRM map
-        PRM_BIN2RGB (dict): dictionary mapping PRM bin number classification to RGB value
+        PRM_BIN2RGB (np.array): lookup table of RGB values indexed by PRM bin number (row 0 is unbinned)
         SCALE_UNIT (float): scalar to convert pixel dimension unit for topological metrics, e.g. set to 1e-3 to convert mm to m
         WIND_RADIUS (int): half the length of one side of nxnxn moving window for calculating local topology, rounded up
         GRID_RES (int): interval (in voxels) between nxnxn moving windows for calculating local topology
@@ -41,7 +44,10 @@ class proc(object):
     PRM_NUM_FSAD = 2
     PRM_NUM_EMPH = 3
     PRM_NUM_EMPTEMPH = 4
-    PRM_BIN2RGB = {1: [0.4, 0.8, 0], 2: [1, 1, 0], 3: [0.8, 0, 0], 4: [0.6, 0.2, 1]}
+    PRM_BIN2RGB = np.array(
+        [[0, 0, 0], [0.4, 0.8, 0], [1, 1, 0], [0.8, 0, 0], [0.6, 0.2, 1]],
+        dtype=np.float32,
+    )
     SCALE_UNIT = 1e-3
     WIND_RADIUS = 11
     GRID_RES = 5
@@ -56,9 +62,11 @@ class outFileNames(object):
         PRM_DIR (str): directory name for PRM niftis
         TOPO_DIR (str): directory name for topology niftis
         PRM_ALL (str): file name for map of all regions from PRM
-        TOPO (str): list of file names for topology maps
+        TOPO (tuple): file names for topology maps
         PRM_STATS (str): file name for csv containing prm stats
         TOPO_STATS (str): file name for csv containing global and local topology metrics
+        CACHE_DIR (str): directory name for cached intermediate arrays
+        MEDFILT_CACHE (tuple): file names for cached median filtered expiratory and inspiratory images
 
     Intended that subject ID will be appended to file name.
     """
@@ -66,6 +74,8 @@ class outFileNames(object):
     PRM_DIR = "prm"
     TOPO_DIR = "prm_topology"
     PRM_ALL = "prm_all_"
-    TOPO = ["vol_", "area_", "curv_", "euler_"]
+    TOPO = ("vol_", "area_", "curv_", "euler_")
     PRM_STATS = "prm_stats_"
     TOPO_STATS = "topology_stats_"
+    CACHE_DIR = ".cache"
+    MEDFILT_CACHE = ("medfilt_exp_", "medfilt_insp_")
@@ -1,22 +1,37 @@
 """Run HRCT PRM + topoligcal mapping pipeline."""
 import argparse
-import glob
 import logging
+import os
+import sys
 import time
-from configparser import ConfigParser
-from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+from configparser import Error as ConfigParserError, RawConfigParser
+from itertools import repeat
 
-from subject_classmap import Subject
 
-# set logging level to that logging.info statements are printed
-logging.basicConfig(level=logging.INFO)
+def positiveInt(value):
+    """Parse a command line argument as a positive integer.
+
+    Args:
+        value (str): command line argument
+
+    Returns:
+        number (int): parsed argument, at least 1
+    """
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value}")
+
+    return number
+
 
 # set command line flags/args
 parser = argparse.ArgumentParser(description="Run HRCT voxel-wise lung image analysis")
 parser.add_argument(
     "--config",
     type=str,
-    metavar="",
+    metavar="PATH",
     required=True,
     help="single subject: config file path. batch processing: directory of config files",
 )
@@ -32,6 +47,27 @@ parser.add_argument(
     required=False,
     help="indicate to calc only prm and global topology",
 )
+parser.add_argument(
+    "--jobs",
+    type=positiveInt,
+    default=1,
+    metavar="N",
+    required=False,
+    help="number of subjects to process in parallel (batch), or number of median "
+    "filter and save threads and PRM regions to map in parallel (single subject)",
+)
+parser.add_argument(
+    "--quiet",
+    action="store_true",
+    required=False,
+    help="indicate to print only warnings and errors",
+)
+parser.add_argument(
+    "--dry-run",
+    action="store_true",
+    required=False,
+    help="indicate to only check that files in config file(s) exist",
+)
 args = parser.parse_args()
 
 
@@ -43,12 +79,19 @@ def processSubject(config, args):
         args: ArgumentParser object containing command line flags
     """
 
+    # import here so that argument errors and --help return without loading the
+    # scientific stack (nibabel, scipy, matplotlib, quantimpy)
+    from subject_classmap import Subject
+
     # record start time for processing subject
     t1 = time.perf_counter()
 
+    # in batch processing, jobs are already used to process subjects in parallel
+    jobs = 1 if args.batch else args.jobs
+
     subject = Subject(config)
 
-    logging.info("*****Processing subject %s*****" % subject.subjID)
+    logging.info("*****Processing subject %s*****", subject.subjID)
 
     if config.has_option("io", "inFilePrm"):
         # if PRM file specified in config, read in PRM map
@@ -72,7 +115,7 @@ def processSubject(config, args):
         # generate PRM maps
         logging.info("Generating PRM maps")
         subject.readCtFiles()
-        subject.applyMedFilts()
+        subject.applyMedFilts(jobs)
         subject.excludeVoxels()
         subject.classifyVoxelsPrm()
 
@@ -85,15 +128,14 @@ def processSubject(config, args):
     logging.info("Calculating global topology metrics")
     subject.genDictOfImageArrays()
     subject.calcTopologyGlobal()
-    subject.saveTopologyStats()
 
     if not args.glbl:
         # if 'glbl' flag not specified, process local topology
 
         # generate local PRM topology maps
         logging.info("Generating PRM topology maps")
-        subject.genLocalTopoMaps()
-        subject.saveTopoNiis()
+        subject.genLocalTopoMaps(jobs)
+        subject.saveTopoNiis(jobs)
         subject.calcMeanLocalTopoStats()
         subject.plotTopoColor()
 
@@ -106,7 +148,167 @@ def processSubject(config, args):
     t2 = time.perf_counter()
     elapsedTime = (t2 - t1) / 60
 
-    logging.info(f"Program runtime: {elapsedTime} mins")
+    logging.info("Program runtime: %s mins", elapsedTime)
+
+
+def initLogging(level):
+    """Configure logging for the current process.
+
+    Args:
+        level (int): logging level, e.g. logging.INFO
+
+    Also run by parallel batch workers, which do not run main().
+    """
+
+    logging.basicConfig(level=level)
+
+
+def initWorker(level):
+    """Initialize a parallel batch worker process.
+
+    Args:
+        level (int): logging level, e.g. logging.INFO
+
+    Limits numerical libraries to one thread per worker (unless already set in the
+    environment) so that parallel subjects do not oversubscribe CPU cores. Must run
+    before the worker imports numpy, which happens lazily in processSubject.
+    """
+
+    for threadVar in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(threadVar, "1")
+    initLogging(level)
+
+
+def processConfigFile(configPath, args):
+    """Read a config file and process the subject it describes.
+
+    Args:
+        configPath (str): path of config file
+        args: ArgumentParser object containing command line flags
+
+    Config is read in the calling process so that parallel batch workers only
+    receive the config file path. A new parser is used for every config file so
+    that no options (including [DEFAULT]) carry over between subjects.
+    """
+
+    # read in config file
+    config = RawConfigParser()
+    config.read(configPath)
+
+    # process subject
+    processSubject(config, args)
+
+
+def findConfigErrors(configPath):
+    """Check that a config file specifies existing input files and output directory.
+
+    Args:
+        configPath (str): path of config file
+
+    Returns:
+        errors (list): description of each problem found in config file
+
+    Also checks that the options required by the input mode (PRM map or HRCTs) are
+    specified and that optional numeric and boolean options can be parsed.
+    """
+
+    # read in config file
+    config = RawConfigParser()
+    try:
+        if not config.read(configPath):
+            return ["config file could not be read"]
+    except ConfigParserError as err:
+        return [f"config file could not be parsed: {err}"]
+    if not config.has_section("io"):
+        return ["config file has no [io] section"]
+
+    # check that options required by input mode are specified
+    if config.has_option("io", "inFilePrm"):
+        requiredOptions = ["inFilePrm"]
+    elif config.has_option("io", "inFileExp"):
+        requiredOptions = ["inFileExp", "inFileInspReg", "inFileMask"]
+    else:
+        return ["neither inFilePrm nor inFileExp is specified in [io]"]
+    errors = [
+        f"{option} is not specified"
+        for option in requiredOptions + ["outDir"]
+        if not config.has_option("io", option)
+    ]
+    if not config.has_option("subjInfo", "subjID"):
+        errors.append("subjID is not specified in [subjInfo]")
+
+    # check that every input file exists (option names are lowercased by the parser)
+    for option, path in config.items("io"):
+        if option.startswith("infile") and not os.path.isfile(path):
+            errors.append(f"{option} does not exist: {path}")
+
+    # check that output directory exists
+    if config.has_option("io", "outDir") and not os.path.isdir(config["io"]["outDir"]):
+        errors.append(f"outDir does not exist: {config['io']['outDir']}")
+
+    # check that optional options can be parsed as the type Subject reads them with
+    for section, option, getter in (
+        ("topo", "windowRadius", config.getint),
+        ("topo", "gridRes", config.getint),
+        ("io", "cacheFilt", config.getboolean),
+    ):
+        try:
+            value = getter(section, option, fallback=None)
+        except ValueError as err:
+            errors.append(f"{option} is invalid: {err}")
+            continue
+        # local topology window parameters must be positive
+        if section == "topo" and value is not None and value < 1:
+            errors.append(f"{option} must be a positive integer: {value}")
+
+    return errors
+
+
+def validateConfigFiles(configList):
+    """Check all config files and log any problems found.
+
+    Args:
+        configList (list): paths of config files
+
+    Returns:
+        valid (bool): True if no problems were found in any config file
+
+    Intended to run before any subject is processed so that a bad path in one
+    config of a batch fails in milliseconds rather than midway through the batch.
+    """
+
+    valid = True
+    for configPath in configList:
+        for error in findConfigErrors(configPath):
+            logging.error("%s: %s", configPath, error)
+            valid = False
+
+    return valid
+
+
+def listConfigFiles(configDir):
+    """List config files in a directory.
+
+    Args:
+        configDir (str): directory containing config files
+
+    Returns:
+        configList (list): sorted paths of config files (.ini) in configDir
+
+    Hidden files are skipped, matching glob behavior. Paths are sorted so that
+    subjects in a batch are processed in a deterministic order.
+    """
+
+    with os.scandir(configDir) as entries:
+        configList = [
+            entry.path
+            for entry in entries
+            if entry.name.endswith(".ini")
+            and not entry.name.startswith(".")
+            and entry.is_file()
+        ]
+
+    return sorted(configList)
 
 
 def main():
@@ -114,28 +316,45 @@ def main():
 
     If no batch processing indicated, run analysis with single config file.
     If batch processing indicated, run analysis on each config file in specified directory.
+    Subjects in a batch are processed in parallel if more than one job is specified.
+    All config files are checked before processing; if dry run indicated, only check them.
     """
 
-    if not args.batch:
-        # read in config file
-        config = ConfigParser()
-        config.read(args.config)
-
-        # process subject
-        processSubject(config, args)
+    # set logging level so that logging.info statements are printed unless quiet
+    logLevel = logging.WARNING if args.quiet else logging.INFO
+    initLogging(logLevel)
 
+    # get list of config files, a single file if no batch processing indicated
+    if not args.batch:
+        configList = [args.config]
+    elif not os.path.isdir(args.config):
+        logging.error("Config file directory does not exist: %s", args.config)
+        sys.exit(1)
     else:
-        # get list of config files in specified directory
-        configList = glob.glob(join(args.config, "*.ini"))
+        configList = listConfigFiles(args.config)
 
-        # loop over config files
-        for configDir in configList:
-            # read in config file
-            config = ConfigParser()
-            config.read(configDir)
+    # check all config files before processing any subject
+    if not validateConfigFiles(configList):
+        sys.exit(1)
+    if args.dry_run:
+        logging.info("All %d config file(s) are valid", len(configList))
+        return
 
-            # process subject
-            processSubject(config, args)
+    if not args.batch:
+        # read in config file and process subject
+        processConfigFile(args.config, args)
+
+    else:
+        if args.jobs > 1:
+            # process subjects in parallel, each worker reads in its own config file
+            with ProcessPoolExecutor(
+                max_workers=args.jobs, initializer=initWorker, initargs=(logLevel,)
+            ) as executor:
+                list(executor.map(processConfigFile, configList, repeat(args)))
+        else:
+            # loop over config files
+            for configPath in configList:
+                processConfigFile(configPath, args)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 """Write config file."""
-from configparser import ConfigParser
+import io
+from configparser import RawConfigParser
 
-config = ConfigParser()
+config = RawConfigParser()
 config.optionxform = str  # make keys case sensitive
 config["subjInfo"] = {"subjID": "000001"}
 config["io"] = {
@@ -12,5 +13,8 @@ config["io"] = {
     "outDir": "path/to/main/out_directory/",
 }
 
+# serialize config to memory first so that it is written to disk in a single call
+buf = io.StringIO()
+config.write(buf)
 with open("../config/config_demo.ini", "w") as f:
-    config.write(f)
+    f.write(buf.getvalue())
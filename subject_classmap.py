@@ -1,12 +1,12 @@
 """Class for generating HRCT PRM and topoligcal maps of the lungs."""
 import logging
 import os
-import pdb
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
 from os.path import exists, join
 
-import nibabel as nib
 import numpy as np
-from quantimpy import minkowski as mk
 
 import constants
 from utils import img_utils, io_utils, plot_utils
@@ -16,13 +16,13 @@ class Subject(object):
     """Class for generating HRCT PRM and topological maps.
 
     Attributes:
-        config (ConfigParser): configuration file
+        config (RawConfigParser): configuration file
         subjID (str): subject ID
         outDir (str): main directory to save output files to
         expArray (np.array): expiratory HRCT in HU
         expArrayPlotting (np.array): expiratory HRCT in HU to use for plotting
         inspRegArray (np.array): inspiratory hrct in HU registered to expiratory HRCT
-        maskArray (np.array): segmentation of thoracic cavity
+        maskArray (np.array): binary (uint8) segmentation of thoracic cavity
         pixDims (np.array): pixel dimenstions in mm
         plotSliceNum (int): slice number along anterior-posterior dimnension to use for plotting
         expArrayFilt (np.array): expiratory image with median filter applied
@@ -33,6 +33,15 @@ class Subject(object):
         topoMapsHiResDict (dict): normalized 3D topological maps for each bin category in image
         topologyStatsGlobal (dict): global topology (Minkowski functionals) metrics for all prm maps
         topologyStatsLocal (dict): mean of local topology (Minkowski functionals) metrics for all prm maps
+        windowRadius (int): half the length of one side of moving window for local topology
+        gridRes (int): interval (in voxels) between moving windows for local topology
+        cacheFilt (bool): whether to cache median filtered images in output directory
+
+    Local topology window parameters are read from the optional [topo] section of the
+    config (windowRadius, gridRes) and default to constants.proc.WIND_RADIUS and GRID_RES;
+    a ValueError is raised if either is less than 1.
+    Median filter caching is off unless cacheFilt is set to true in the [io] section.
+    Image arrays and plotSliceNum are None until set by the corresponding processing step.
     """
 
     def __init__(self, config):
@@ -40,45 +49,70 @@ class Subject(object):
         self.config = config
         self.subjID = config["subjInfo"]["subjID"]
         self.outDir = config["io"]["outDir"]
-        self.expArray = np.array([])
-        self.expArrayPlotting = np.array([])
-        self.inspRegArray = np.array([])
-        self.maskArray = np.array([])
-        self.pixDims = np.array([])
-        self.plotSliceNum = int
-        self.expArrayFilt = np.array([])
-        self.inspRegArrayFilt = np.array([])
-        self.prmAllArray = np.array([])
+        self.expArray = None
+        self.expArrayPlotting = None
+        self.inspRegArray = None
+        self.maskArray = None
+        self.pixDims = None
+        self.plotSliceNum = None
+        self.expArrayFilt = None
+        self.inspRegArrayFilt = None
+        self.prmAllArray = None
         self.prmStats = {}
         self.binArrayDict = {}
         self.topoMapsHiResDict = {}
         self.topologyStatsGlobal = {}
         self.topologyStatsLocal = {}
+        self.windowRadius = config.getint(
+            "topo", "windowRadius", fallback=constants.proc.WIND_RADIUS
+        )
+        self.gridRes = config.getint(
+            "topo", "gridRes", fallback=constants.proc.GRID_RES
+        )
+        self.cacheFilt = config.getboolean("io", "cacheFilt", fallback=False)
+
+        # fail before any processing rather than after PRM outputs are written
+        if self.windowRadius < 1 or self.gridRes < 1:
+            raise ValueError(
+                "windowRadius and gridRes must be positive integers, got "
+                f"{self.windowRadius} and {self.gridRes}"
+            )
 
     def readCtFiles(self):
         """Read in CT and mask files and convert to np.array.
 
         Read in files containing expiratory and inspiratory HRCTs and mask (.nii).
-        Save a copy of expiratory HRCT for plotting.
+        Expiratory HRCT for plotting shares memory with expArray until expArray is
+        modified in place.
         """
-        self.expArray, self.pixDims = io_utils.readFiles(self.config["io"]["inFileExp"])
-        self.inspRegArray, _ = io_utils.readFiles(self.config["io"]["inFileInspReg"])
-        self.maskArray, _ = io_utils.readFiles(self.config["io"]["inFileMask"])
+        # read HRCTs directly as float32, which is exact for HU values
+        self.expArray, self.pixDims = io_utils.readFiles(
+            self.config["io"]["inFileExp"], np.float32
+        )
+        self.inspRegArray, _ = io_utils.readFiles(
+            self.config["io"]["inFileInspReg"], np.float32
+        )
+        maskArray, _ = io_utils.readFiles(self.config["io"]["inFileMask"])
 
-        # ensure that HRCT arrays are in usable data type
-        self.expArray = self.expArray.astype(float)
-        self.inspRegArray = self.inspRegArray.astype(float)
+        # store mask as binary uint8, since only lung vs non-lung voxels are used
+        self.maskArray = (maskArray >= 1).astype(np.uint8)
 
-        # make separate copy of expiratory HRCT to use for plotting
-        self.expArrayPlotting = np.copy(self.expArray)
+        # reference expiratory HRCT for plotting, copied only if expArray is dimmed
+        self.expArrayPlotting = self.expArray
 
     def dimOutsideVoxels(self):
         """Dim voxels outside of thoracic cavity.
 
         NOTE: currently unused.
         """
-        self.expArray[self.maskArray == 0] = constants.preProc.DIM_OUTSIDE_VAL
-        self.inspRegArray[self.maskArray == 0] = constants.preProc.DIM_OUTSIDE_VAL
+        # keep an undimmed copy of expiratory HRCT for plotting
+        if self.expArrayPlotting is self.expArray:
+            self.expArrayPlotting = np.copy(self.expArray)
+
+        # find voxels outside of mask once and dim them in both HRCTs
+        outside = self.maskArray == 0
+        np.putmask(self.expArray, outside, constants.preProc.DIM_OUTSIDE_VAL)
+        np.putmask(self.inspRegArray, outside, constants.preProc.DIM_OUTSIDE_VAL)
 
     def orientImages(self):
         """Put HRCTs into proper orientation.
@@ -87,25 +121,77 @@ class Subject(object):
 
         NOTE: currently unused, depricated
         """
-        self.expArray = np.rot90(np.swapaxes(self.expArray, 0, 2), 2)[:, ::-1, :]
-        self.expArrayPlotting = np.rot90(np.swapaxes(self.expArrayPlotting, 0, 2), 2)[
-            :, ::-1, :
+        self.expArray = img_utils.orientImage(self.expArray)
+        self.expArrayPlotting = img_utils.orientImage(self.expArrayPlotting)
+        self.inspRegArray = img_utils.orientImage(self.inspRegArray)
+        self.maskArray = img_utils.orientImage(self.maskArray)
+
+    def applyMedFilts(self, jobs=1):
+        """Apply moving 2D median filter to images.
+
+        Args:
+            jobs (int): number of threads to filter each image with
+
+        Only the bounding box of the mask is filtered, padded so that every voxel in
+        the mask has the same neighborhood as in the full image. Voxels outside of the
+        bounding box are never classified and are left unfiltered.
+
+        Filtered images are cached in the output directory, keyed by the input files
+        and kernel size, so that re-processing a subject skips the filter (only if
+        cacheFilt is True). Only the most recent cache of each subject is kept.
+        """
+
+        # create cache paths for filtered images from input files and filter parameters
+        cacheKey = io_utils.createFileCacheKey(
+            [
+                self.config["io"]["inFileExp"],
+                self.config["io"]["inFileInspReg"],
+                self.config["io"]["inFileMask"],
+            ],
+            constants.preProc.MEDFILT_KERNEL_SIZE,
+            self.expArray.dtype.str,
+        )
+        cacheDir = join(self.outDir, constants.outFileNames.CACHE_DIR)
+        cachePrefixes = [
+            fName + self.subjID + "_" for fName in constants.outFileNames.MEDFILT_CACHE
         ]
-        self.inspRegArray = np.rot90(np.swapaxes(self.inspRegArray, 0, 2), 2)[
-            :, ::-1, :
+        expCachePath, inspCachePath = [
+            join(cacheDir, prefix + cacheKey + ".npy") for prefix in cachePrefixes
         ]
-        self.maskArray = np.rot90(np.swapaxes(self.maskArray, 0, 2), 2)[:, ::-1, :]
 
-    def applyMedFilts(self):
-        """Apply moving 2D median filter to images."""
+        if self.cacheFilt and exists(expCachePath) and exists(inspCachePath):
+            # load filtered images from cache
+            logging.info("Loading median filtered images from cache")
+            self.expArrayFilt = np.load(expCachePath, mmap_mode="r")
+            self.inspRegArrayFilt = np.load(inspCachePath, mmap_mode="r")
+            return
 
-        self.expArrayFilt = img_utils.medFilt(
-            self.expArray, constants.preProc.MEDFILT_KERNEL_SIZE
+        # filter images within bounding box of mask
+        bbox = img_utils.findBoundingBox(
+            self.maskArray, pad=constants.preProc.MEDFILT_KERNEL_SIZE // 2
+        )
+        self.expArrayFilt = np.copy(self.expArray)
+        self.expArrayFilt[bbox] = img_utils.medFilt(
+            self.expArray[bbox], constants.preProc.MEDFILT_KERNEL_SIZE, jobs
         )
-        self.inspRegArrayFilt = img_utils.medFilt(
-            self.inspRegArray, constants.preProc.MEDFILT_KERNEL_SIZE
+        self.inspRegArrayFilt = np.copy(self.inspRegArray)
+        self.inspRegArrayFilt[bbox] = img_utils.medFilt(
+            self.inspRegArray[bbox], constants.preProc.MEDFILT_KERNEL_SIZE, jobs
         )
 
+        # cache filtered images for subsequent runs, replacing stale caches of subject
+        if self.cacheFilt:
+            os.makedirs(cacheDir, exist_ok=True)
+            for prefix, cachePath in zip(cachePrefixes, [expCachePath, inspCachePath]):
+                io_utils.removeStaleCacheFiles(cacheDir, prefix, cachePath)
+            io_utils.saveCacheArray(self.expArrayFilt, expCachePath)
+            io_utils.saveCacheArray(self.inspRegArrayFilt, inspCachePath)
+            logging.info(
+                "Cached median filtered images (%.1f MB) in %s",
+                (self.expArrayFilt.nbytes + self.inspRegArrayFilt.nbytes) / 1e6,
+                cacheDir,
+            )
+
     def excludeVoxels(self):
         """Exclude voxels above and below certain thresholds.
 
@@ -113,21 +199,19 @@ class Subject(object):
         minimize the contribution of blood vessels and airways.
         """
 
-        # exclude voxels in filtered expiratory image
-        self.maskArray[
-            self.expArrayFilt < constants.preProc.EXCLUDE_VOX_LOWERTHRESH
-        ] = 0
-        self.maskArray[
-            self.expArrayFilt > constants.preProc.EXCLUDE_VOX_UPPERTHRESH
-        ] = 0
-
-        # exclude voxels in filtered inspiratory image
-        self.maskArray[
-            self.inspRegArrayFilt < constants.preProc.EXCLUDE_VOX_LOWERTHRESH
-        ] = 0
-        self.maskArray[
-            self.inspRegArrayFilt > constants.preProc.EXCLUDE_VOX_UPPERTHRESH
-        ] = 0
+        lowerThresh = constants.preProc.EXCLUDE_VOX_LOWERTHRESH
+        upperThresh = constants.preProc.EXCLUDE_VOX_UPPERTHRESH
+
+        # find voxels outside of thresholds in filtered expiratory or inspiratory image
+        excludeVox = (
+            (self.expArrayFilt < lowerThresh)
+            | (self.expArrayFilt > upperThresh)
+            | (self.inspRegArrayFilt < lowerThresh)
+            | (self.inspRegArrayFilt > upperThresh)
+        )
+
+        # exclude voxels from mask in a single write
+        np.putmask(self.maskArray, excludeVox, 0)
 
     def classifyVoxelsPrm(self):
         """Create maps of norm, fSAD, emph, and emptying emph voxels.
@@ -136,49 +220,40 @@ class Subject(object):
         expiratory and inspiratory images and HU thresholds.
         """
 
-        # get indices of normal, fSAD, emph, and emptying emph regions within mask
-        normIdx = np.argwhere(
-            (self.expArrayFilt > constants.proc.EXP_THRESH)
-            & (self.inspRegArrayFilt > constants.proc.INSP_THRESH)
-            & (self.maskArray >= 1)
-        )
-        fSadIdx = np.argwhere(
-            (self.expArrayFilt < constants.proc.EXP_THRESH)
-            & (self.inspRegArrayFilt > constants.proc.INSP_THRESH)
-            & (self.maskArray >= 1)
-        )
-        emphIdx = np.argwhere(
-            (self.expArrayFilt < constants.proc.EXP_THRESH)
-            & (self.inspRegArrayFilt < constants.proc.INSP_THRESH)
-            & (self.maskArray >= 1)
-        )
-        emptEmphIdx = np.argwhere(
-            (self.expArrayFilt > constants.proc.EXP_THRESH)
-            & (self.inspRegArrayFilt <= constants.proc.INSP_THRESH)
-            & (self.maskArray >= 1)
-        )
+        expThresh = constants.proc.EXP_THRESH
+        inspThresh = constants.proc.INSP_THRESH
+
+        # compare each filtered image to its PRM threshold once, restricted to mask
+        inMask = self.maskArray >= 1
+        expHi = (self.expArrayFilt > expThresh) & inMask
+        expLo = (self.expArrayFilt < expThresh) & inMask
+        inspHi = self.inspRegArrayFilt > inspThresh
 
         # for combined classification, set each region to different number (using IMBIO standard)
-        self.prmAllArray = np.zeros(self.expArrayFilt.shape)
+        # bin numbers fit in uint8, so store map as uint8 rather than float64
+        self.prmAllArray = np.zeros(self.expArrayFilt.shape, dtype=np.uint8)
+        self.prmAllArray[expHi & inspHi] = constants.proc.PRM_NUM_NORM
+        self.prmAllArray[expLo & inspHi] = constants.proc.PRM_NUM_FSAD
         self.prmAllArray[
-            normIdx[:, 0], normIdx[:, 1], normIdx[:, 2]
-        ] = constants.proc.PRM_NUM_NORM
-        self.prmAllArray[
-            fSadIdx[:, 0], fSadIdx[:, 1], fSadIdx[:, 2]
-        ] = constants.proc.PRM_NUM_FSAD
-        self.prmAllArray[
-            emphIdx[:, 0], emphIdx[:, 1], emphIdx[:, 2]
+            expLo & (self.inspRegArrayFilt < inspThresh)
         ] = constants.proc.PRM_NUM_EMPH
         self.prmAllArray[
-            emptEmphIdx[:, 0], emptEmphIdx[:, 1], emptEmphIdx[:, 2]
+            expHi & (self.inspRegArrayFilt <= inspThresh)
         ] = constants.proc.PRM_NUM_EMPTEMPH
 
     def readPrmFile(self):
         """Read in PRM file and extract indvidual PRM maps."""
 
-        self.prmAllArray, self.pixDims = io_utils.readFiles(
-            self.config["io"]["inFilePrm"]
-        )
+        prmAllArray, self.pixDims = io_utils.readFiles(self.config["io"]["inFilePrm"])
+
+        # store map with integer labels as uint8 like a generated PRM map, saturating out
+        # of range values (which match no bin), and keep any other map as read so that
+        # fractional or NaN labels are neither truncated into a bin nor out of the mask
+        if np.issubdtype(prmAllArray.dtype, np.integer) or np.array_equal(
+            prmAllArray, np.rint(prmAllArray)
+        ):
+            prmAllArray = np.clip(prmAllArray, 0, 255).astype(np.uint8)
+        self.prmAllArray = prmAllArray
 
     def readMaskFile(self):
         """Read in mask file and convert to np.array.
@@ -186,38 +261,53 @@ class Subject(object):
         Intended for when input PRM map and mask file are specified in config.
         """
 
-        self.maskArray, _ = io_utils.readFiles(self.config["io"]["inFileMask"])
+        maskArray, _ = io_utils.readFiles(self.config["io"]["inFileMask"])
+        self.maskArray = (maskArray >= 1).astype(np.uint8)
 
     def genMaskFromPrm(self):
         """Generate binary mask from PRM map."""
 
-        self.maskArray = (self.prmAllArray > 0).astype(int)
+        self.maskArray = (self.prmAllArray > 0).astype(np.uint8)
 
     def genDictOfImageArrays(self):
         """Separate binned PRM image into a list of arrays.
 
-        Each array in the list is a binary image for one of the bins.
+        Each array in the list is a boolean binary image for one of the bins.
         """
 
-        # loop over bin numbers and extract individual binary image arrays
-        for binNum in constants.proc.BIN_DICT.keys():
-            binArray = np.ascontiguousarray((self.prmAllArray == binNum).astype(int))
-            self.binArrayDict[binNum] = binArray
+        # compare PRM map to every bin number in a single broadcast operation, keeping
+        # boolean results so that Minkowski functionals use them without conversion
+        binNums = list(constants.proc.BIN_DICT.keys())
+        binArrays = np.equal.outer(binNums, self.prmAllArray)
+
+        # store individual binary image arrays
+        for binNum, binArray in zip(binNums, binArrays):
+            self.binArrayDict[binNum] = np.ascontiguousarray(binArray)
 
     def calcPrmStats(self):
         """Calculate percentage of voxels in each PRM classification."""
 
         # get number of voxels in thoracic cavity
-        numMaskVoxels = (self.maskArray > 0).sum()
+        numMaskVoxels = np.count_nonzero(self.maskArray > 0)
 
         # define subject ID into stats dictionary
         self.prmStats["sid"] = self.subjID
 
-        # loop over each bin number and get percentage of voxels in each bin
-        for binNum in constants.proc.BIN_DICT.keys():
-            self.prmStats[constants.proc.BIN_DICT[binNum] + "_prct"] = (
-                100 * np.count_nonzero(self.prmAllArray == binNum) / numMaskVoxels
+        # count voxels with each bin number, in a single pass over uint8 PRM map
+        if self.prmAllArray.dtype == np.uint8:
+            binCounts = np.bincount(
+                self.prmAllArray.ravel(order="K"),
+                minlength=max(constants.proc.BIN_DICT) + 1,
             )
+        else:
+            binCounts = {
+                binNum: np.count_nonzero(self.prmAllArray == binNum)
+                for binNum in constants.proc.BIN_DICT
+            }
+
+        # loop over each bin number and get percentage of voxels in each bin
+        for binNum, binName in constants.proc.BIN_DICT.items():
+            self.prmStats[binName + "_prct"] = 100 * binCounts[binNum] / numMaskVoxels
 
         # create out path and save stats as csv
         prmStatsOutPath = join(
@@ -267,13 +357,21 @@ class Subject(object):
         for classification maps of all PRM regions.
         """
 
+        # crop to bounding box of mask and binned voxels (an input PRM map may extend
+        # beyond the mask) to skip voxels outside of lungs, padded by one voxel so that
+        # regions do not touch the image edge (which changes mk fns)
+        bbox = img_utils.findBoundingBox(
+            (self.maskArray > 0) | (self.prmAllArray > 0), pad=1
+        )
+        maskCrop = self.maskArray[bbox]
+
         # loop over each bin number
         for binNum in constants.proc.BIN_DICT.keys():
             # retrieve bin image array
-            binArray = self.binArrayDict[binNum]
+            binArray = self.binArrayDict[binNum][bbox]
 
             # get array containing global mk fns for each prm region
-            binGlobal = img_utils.calcMkFnsNorm(binArray, self.maskArray, self.pixDims)
+            binGlobal = img_utils.calcMkFnsNorm(binArray, maskCrop, self.pixDims)
 
             # create dictionary from array
             binGlobalDict = io_utils.createMkFnDict(
@@ -283,32 +381,54 @@ class Subject(object):
             # merge with main global topology stats dictionary
             self.topologyStatsGlobal.update(binGlobalDict)
 
-    def genLocalTopoMaps(self):
+    def genLocalTopoMaps(self, jobs=1):
         """Generate 3D maps of local topology features for all PRM maps.
 
+        Args:
+            jobs (int): number of PRM regions to map in parallel processes
+
         Calculates maps of local volume, surface area, curvature, and the Euler characteristic
         for classification maps of all PRM regions.
         """
 
-        # loop over each bin number
-        for binNum in constants.proc.BIN_DICT.keys():
-            # generate low resolution 3D local topolgy maps
-            binTopoMaps = img_utils.genLowResTopoMaps(
-                self.binArrayDict[binNum], self.maskArray, self.pixDims
-            )
-            logging.info(
-                constants.proc.BIN_DICT[binNum]
-                + " low resolution local topology mapping complete."
+        # generate low resolution 3D local topolgy maps, in parallel processes if more
+        # than one job is specified (regions are independent)
+        binNums = list(constants.proc.BIN_DICT.keys())
+        if jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=min(jobs, len(binNums)))
+            mapFn = executor.map
+        else:
+            executor = nullcontext()
+            mapFn = map
+
+        with executor:
+            lowResTopoMaps = mapFn(
+                img_utils.genLowResTopoMaps,
+                [self.binArrayDict[binNum] for binNum in binNums],
+                repeat(self.maskArray),
+                repeat(self.pixDims),
+                repeat(self.windowRadius),
+                repeat(self.gridRes),
             )
 
-            # generate high resolution 3D maps using interpolation
-            self.topoMapsHiResDict[binNum] = img_utils.resizeTopoMaps(
-                self.binArrayDict[binNum].shape, self.maskArray, binTopoMaps
-            )
-            logging.info(
-                constants.proc.BIN_DICT[binNum]
-                + " high resolution local topology mapping interpolation complete."
-            )
+            # loop over each bin number as its low resolution maps become available
+            for binNum, binTopoMaps in zip(binNums, lowResTopoMaps):
+                logging.info(
+                    "%s low resolution local topology mapping complete.",
+                    constants.proc.BIN_DICT[binNum],
+                )
+
+                # generate high resolution 3D maps using interpolation
+                self.topoMapsHiResDict[binNum] = img_utils.resizeTopoMaps(
+                    self.binArrayDict[binNum].shape,
+                    self.maskArray,
+                    binTopoMaps,
+                    self.windowRadius,
+                )
+                logging.info(
+                    "%s high resolution local topology mapping interpolation complete.",
+                    constants.proc.BIN_DICT[binNum],
+                )
 
     def calcMeanLocalTopoStats(self):
         """Calculate whole lung mean of each topology metric in local topology maps."""
@@ -326,29 +446,33 @@ class Subject(object):
             # merge with main local topology stats dictionary
             self.topologyStatsLocal.update(binLocalDict)
 
-    def saveTopoNiis(self):
-        """Save topology maps as niftis."""
+    def saveTopoNiis(self, jobs=1):
+        """Save topology maps as niftis.
 
-        # if it doesn't already exists, create directory for topology niftis
-        if not exists(join(self.outDir, constants.outFileNames.TOPO_DIR)):
-            os.mkdir(join(self.outDir, constants.outFileNames.TOPO_DIR))
+        Args:
+            jobs (int): number of threads to save niftis with
+        """
 
-        # loop over each bin number
-        for binNum in constants.proc.BIN_DICT.keys():
-            # loop over topology arrays and save them as niftis
-            for i in range(self.topoMapsHiResDict[binNum].shape[0]):
-                outPath = join(
-                    self.outDir,
-                    constants.outFileNames.TOPO_DIR,
-                    "prm_"
-                    + constants.proc.BIN_DICT[binNum]
-                    + "_"
-                    + constants.outFileNames.TOPO[i]
-                    + self.subjID,
-                )
-                io_utils.saveAsNii(
-                    self.topoMapsHiResDict[binNum][i, :, :, :], outPath, self.pixDims
+        # if it doesn't already exists, create directory for topology niftis
+        topoDir = join(self.outDir, constants.outFileNames.TOPO_DIR)
+        if not exists(topoDir):
+            os.mkdir(topoDir)
+
+        # collect topology arrays of each bin number and their out paths
+        topoArrays = []
+        outPaths = []
+        for binNum, binName in constants.proc.BIN_DICT.items():
+            for i, topoName in enumerate(constants.outFileNames.TOPO):
+                topoArrays.append(self.topoMapsHiResDict[binNum][i, :, :, :])
+                outPaths.append(join(topoDir, f"prm_{binName}_{topoName}{self.subjID}"))
+
+        # save topology arrays as niftis, writing files concurrently if jobs > 1
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(
+                executor.map(
+                    io_utils.saveAsNii, topoArrays, outPaths, repeat(self.pixDims)
                 )
+            )
 
     def plotTopoColor(self):
         """Plot slice of select local topology maps."""
@@ -356,22 +480,16 @@ class Subject(object):
         # specify units of topology map
         mapUnit = "m$^{-1}$"
 
-        # plot surface area density for each bin number
-        for binNum in constants.proc.BIN_DICT.keys():
-            # norm surface area density
+        # plot surface area density (second topology map) for each bin number
+        areaIdx = 1
+        areaName = constants.outFileNames.TOPO[areaIdx]
+        for binNum, binName in constants.proc.BIN_DICT.items():
             binAreaOutPath = join(
-                self.outDir,
-                "prm_"
-                + constants.proc.BIN_DICT[binNum]
-                + "_"
-                + constants.outFileNames.TOPO[1]
-                + "color_"
-                + self.subjID
-                + ".png",
+                self.outDir, f"prm_{binName}_{areaName}color_{self.subjID}.png"
             )
             plot_utils.plotTopo(
                 self.maskArray,
-                self.topoMapsHiResDict[binNum][1, :, :, :],
+                self.topoMapsHiResDict[binNum][areaIdx, :, :, :],
                 self.plotSliceNum,
                 mapUnit,
                 binAreaOutPath,
@@ -1,7 +1,7 @@
 """Utils for image processing."""
 import math
-import pdb
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 
 import numpy as np
 import scipy.signal
@@ -11,66 +11,200 @@ from skimage.transform import resize
 import constants
 
 
-def normalizeCt(image: np.ndarray, mask: np.ndarray):
+def normalizeCt(image: np.ndarray, mask: np.ndarray, out: np.ndarray = None):
     """Normalize CT image.
 
     Args:
         image (np.array): CT image to be normalized
         mask (np.array): segmentation mask of CT image, must have same shape as image
+        out (np.array): optional array to store normalized image in (can be image)
 
     Returns:
         imageNorm (np.array): normalized CT image
 
     Sets positive voxels to zero and normalizes CT based on min and max voxels in mask.
+    Integer images are normalized as floating point (at least float32).
     """
 
-    # set positive voxels to zero and normalize image
+    # set positive voxels to zero and find min and max voxels in mask
     image[image > 0] = 0
-    minVox = min(image[mask >= 1].flatten())
-    maxVox = max(image[mask >= 1].flatten())
-    imageNorm = 1000 / (maxVox - minVox) * (image - minVox) - 1000
+    maskedVox = image[mask >= 1]
+    minVox = maskedVox.min()
+    maxVox = maskedVox.max()
+
+    # normalize image with in-place operations, allocating at most one new array
+    imageNorm = np.subtract(
+        image, minVox, out=out, dtype=np.result_type(image, np.float32)
+    )
+    imageNorm *= 1000 / (maxVox - minVox)
+    imageNorm -= 1000
 
     return imageNorm
 
 
-def medFilt(image: np.ndarray, kernelSize: int):
+def orientImage(image: np.ndarray):
+    """Rotate 180 degrees and reflect image.
+
+    Args:
+        image (np.array): input image
+
+    Returns:
+        imageOriented (np.array): C-contiguous oriented image
+
+    Equivalent to np.rot90(np.swapaxes(image, 0, 2), 2)[:, ::-1, :], which composes to
+    one transpose + flip and is materialized in a single copy.
+    """
+    imageOriented = np.ascontiguousarray(image.transpose(2, 1, 0)[::-1])
+
+    return imageOriented
+
+
+# compare-exchange index pairs of a sorting network that moves the median of 9 values to index 4
+MEDIAN9_EXCHANGES = (
+    (1, 2), (4, 5), (7, 8), (0, 1), (3, 4), (6, 7), (1, 2), (4, 5), (7, 8), (0, 3),
+    (5, 8), (4, 7), (3, 6), (1, 4), (2, 5), (4, 7), (4, 2), (6, 4), (4, 2),
+)  # fmt: skip
+
+
+def medFilt3x3(image: np.ndarray):
+    """Apply moving 3x3 median filter to each 2D slice along the last dimension.
+
+    Args:
+        image (np.array): input image
+
+    Returns:
+        imageFilt (np.array): filtered image, equal to scipy.signal.medfilt2d with
+                                kernel size 3 applied to each slice (zero padded edges)
+
+    Sorts the 9 neighbors of all voxels at once with a fixed network of elementwise
+    min/max operations instead of sorting each window separately.
+    NOTE: allocates 10 temporary arrays the size of image, intended for slabs of slices
+    """
+
+    # get the 9 shifted copies of the zero padded image that make up each 3x3 window
+    nx, ny = image.shape[0], image.shape[1]
+    paddedImage = np.pad(image, ((1, 1), (1, 1), (0, 0)))
+    neighbors = [
+        paddedImage[i : i + nx, j : j + ny].copy() for i in range(3) for j in range(3)
+    ]
+
+    # compare-exchange neighbor arrays, reusing one buffer for the minimum
+    lowerBuf = np.empty_like(neighbors[0])
+    for a, b in MEDIAN9_EXCHANGES:
+        np.minimum(neighbors[a], neighbors[b], out=lowerBuf)
+        np.maximum(neighbors[a], neighbors[b], out=neighbors[b])
+        neighbors[a], lowerBuf = lowerBuf, neighbors[a]
+
+    return neighbors[4]
+
+
+def medFiltSlab(image: np.ndarray, imageFilt: np.ndarray, kernelSize: int, s0: int):
+    """Apply moving 2D median filter to one slab of slices.
+
+    Args:
+        image (np.array): input image
+        imageFilt (np.array): output image that filtered slab is written into
+        kernelSize (int): size of moving window
+        s0 (int): index of first slice in slab
+
+    Slab contains constants.preProc.MEDFILT_SLAB_SIZE slices along the third axis.
+    """
+    s1 = min(s0 + constants.preProc.MEDFILT_SLAB_SIZE, image.shape[2])
+    if kernelSize == 3:
+        imageFilt[:, :, s0:s1] = medFilt3x3(image[:, :, s0:s1])
+    else:
+        for s in range(s0, s1):
+            imageFilt[:, :, s] = scipy.signal.medfilt2d(
+                image[:, :, s], kernel_size=kernelSize
+            )
+
+
+def medFilt(image: np.ndarray, kernelSize: int, jobs: int = 1):
     """Apply moving 2D median filter.
 
     Args:
         image (np.array): input image
         kernelSize (int): size of moving window
+        jobs (int): number of threads to filter slabs with
 
     Returns:
-        imageFilt (np.array): filtered image
+        imageFilt (np.array): filtered image with same data type as image
+
+    Slices are filtered in slabs of constants.preProc.MEDFILT_SLAB_SIZE. A 3x3 kernel
+    uses the vectorized sorting network in medFilt3x3, other sizes use scipy's medfilt2d.
+    Both release the GIL, so slabs can be filtered in parallel threads.
     """
-    imageFilt = np.zeros(image.shape)
-    for s in range(0, image.shape[2]):
-        imageFilt[:, :, s] = scipy.signal.medfilt2d(
-            image[:, :, s], kernel_size=kernelSize
-        )
+    imageFilt = np.empty_like(image)
+    slabStarts = range(0, image.shape[2], constants.preProc.MEDFILT_SLAB_SIZE)
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(
+                executor.map(
+                    medFiltSlab,
+                    repeat(image),
+                    repeat(imageFilt),
+                    repeat(kernelSize),
+                    slabStarts,
+                )
+            )
+    else:
+        for s0 in slabStarts:
+            medFiltSlab(image, imageFilt, kernelSize, s0)
 
     return imageFilt
 
 
-def bin2rgb(binImage: np.ndarray, colMap: Dict[int, np.ndarray]):
+def bin2rgb(binImage: np.ndarray, colMap: np.ndarray):
     """Convert image of bin numbers to rgb.
 
     Args:
         binImage (np.array): input image where each element denotes a bin number
-        colMap (Dict[int, np.ndarray]): dictionary mapping bin number to RGB values
+        colMap (np.array): lookup table of RGB values where row index is the bin number
+                            (e.g. constants.proc.PRM_BIN2RGB)
 
     Returns:
         rgbImage (np.array): RGB image of shape (x, y, z, 3)
 
+    Voxels whose value is not a row index of colMap (negative, too large, fractional,
+    or NaN) are treated as bin 0 and left black.
+
     NOTE: this function is currently unused in the pipeline
     """
-    rgbImage = np.zeros((binImage.shape[0], binImage.shape[1], binImage.shape[2], 3))
-    for binNum in colMap.keys():
-        rgbImage[binImage == binNum] = colMap[binNum]
+    # map values that are not a row of lookup table to bin 0
+    inTable = (binImage >= 0) & (binImage < len(colMap)) & (binImage % 1 == 0)
+    binIdx = np.where(inTable, binImage, 0).astype(np.intp)
+
+    # gather RGB value of every voxel from lookup table in a single pass
+    rgbImage = colMap[binIdx]
 
     return rgbImage
 
 
+def findBoundingBox(mask: np.ndarray, pad: int = 0):
+    """Find bounding box of positive voxels in a mask.
+
+    Args:
+        mask (np.array): image where positive integers denote regions of interest
+        pad (int): number of voxels to extend bounding box by on each side
+
+    Returns:
+        bbox (tuple): slice along each dimension of mask, usable to index mask
+
+    If mask contains no positive voxels, bbox spans the whole image.
+    """
+    maskBool = mask > 0
+    bbox = []
+    for axis in range(mask.ndim):
+        # project mask onto axis and find first and last positive index
+        otherAxes = tuple(a for a in range(mask.ndim) if a != axis)
+        idx = np.flatnonzero(maskBool.any(axis=otherAxes))
+        if idx.size == 0:
+            return tuple(slice(None) for _ in range(mask.ndim))
+        bbox.append(slice(max(idx[0] - pad, 0), idx[-1] + 1 + pad))
+
+    return tuple(bbox)
+
+
 def calcMkFns(binaryImage: np.ndarray, pixDims: np.ndarray):
     """Calculate Minkowski functionals for a binary image.
 
@@ -84,8 +218,9 @@ def calcMkFns(binaryImage: np.ndarray, pixDims: np.ndarray):
     NOTE: this function does not normalize by masked volume or masked voxel count
     """
 
-    # convert input binary array to boolean array
-    boolImage = np.array(binaryImage, dtype=bool)
+    # convert input binary array to C-contiguous boolean array (quantimpy requires it),
+    # without copying if it already is one
+    boolImage = np.ascontiguousarray(binaryImage, dtype=bool)
 
     # temporarily scale pix dims up (quantimpy requires them to be >=1)
     pixDimsScale = 10
@@ -118,8 +253,9 @@ def calcMkFnsNorm(binaryImage: np.ndarray, mask: np.ndarray, pixDims: np.ndarray
                                 normalized by masked volume and Euler-Poincare characteristic by masked voxel count
     """
 
-    # convert input binary array to boolean array
-    boolImage = np.array(binaryImage, dtype=bool)
+    # convert input binary array to C-contiguous boolean array (quantimpy requires it),
+    # without copying if it already is one
+    boolImage = np.ascontiguousarray(binaryImage, dtype=bool)
 
     # temporarily scale pix dims up (quantimpy requires them to be >=1)
     pixDimsScale = 10
@@ -133,7 +269,7 @@ def calcMkFnsNorm(binaryImage: np.ndarray, mask: np.ndarray, pixDims: np.ndarray
 
     # normalize volume, surface area, and curvature by masked volume and euler-poincare characteristic by masked voxel count
     # normalized dims: vol_norm -> unitless, area_norm -> [length]^-1, curv_norm -> [length]^-2, euler_norm -> unitless
-    maskedVoxels = (mask > 0).sum()
+    maskedVoxels = np.count_nonzero(mask > 0)
     maskedVol = maskedVoxels * (pixDims[0] * pixDims[1] * pixDims[2])
     if maskedVoxels > 0:
         mkFnsArray = np.divide(
@@ -167,13 +303,21 @@ def genLowResGrid(highResImgShape: np.ndarray, windowRadius: int, gridRes: int):
     return lowResGrid
 
 
-def genLowResTopoMaps(binaryImage: np.ndarray, mask: np.ndarray, pixDims: np.ndarray):
+def genLowResTopoMaps(
+    binaryImage: np.ndarray,
+    mask: np.ndarray,
+    pixDims: np.ndarray,
+    windowRadius: int = constants.proc.WIND_RADIUS,
+    gridRes: int = constants.proc.GRID_RES,
+):
     """Generate low resolution 3D maps of local topology for a binary image by passing moving window over input image.
 
     Args:
         binaryImage (np.array): image of zeros and ones denoting PRM regions
         mask (np.array): mask of thoracic cavity in input binaryImage
         pixDims (np.array): pixel dimensions of binaryImage
+        windowRadius (int): half the length of one side of nxnxn moving window
+        gridRes (int): interval (in voxels) between nxnxn moving windows
 
     Returns:
         lowResTopoMaps (np.array): 4xnxmxp array containing normalized low resolution topology maps for
@@ -184,43 +328,15 @@ def genLowResTopoMaps(binaryImage: np.ndarray, mask: np.ndarray, pixDims: np.nda
     """
 
     # initialize low resolution arrays in which to store local topology calculations
-    volMap = genLowResGrid(
-        binaryImage.shape,
-        constants.proc.WIND_RADIUS,
-        constants.proc.GRID_RES,
-    )
-    areaMap = genLowResGrid(
-        binaryImage.shape,
-        constants.proc.WIND_RADIUS,
-        constants.proc.GRID_RES,
-    )
-    curvMap = genLowResGrid(
-        binaryImage.shape,
-        constants.proc.WIND_RADIUS,
-        constants.proc.GRID_RES,
-    )
-    eulerMap = genLowResGrid(
-        binaryImage.shape,
-        constants.proc.WIND_RADIUS,
-        constants.proc.GRID_RES,
-    )
+    volMap = genLowResGrid(binaryImage.shape, windowRadius, gridRes)
+    areaMap = genLowResGrid(binaryImage.shape, windowRadius, gridRes)
+    curvMap = genLowResGrid(binaryImage.shape, windowRadius, gridRes)
+    eulerMap = genLowResGrid(binaryImage.shape, windowRadius, gridRes)
 
     # get indices of the center of each window along each dimension in high resolution input binary image
-    iIdxHighRes = range(
-        constants.proc.WIND_RADIUS,
-        binaryImage.shape[0] - constants.proc.WIND_RADIUS + 1,
-        constants.proc.GRID_RES,
-    )
-    jIdxHighRes = range(
-        constants.proc.WIND_RADIUS,
-        binaryImage.shape[1] - constants.proc.WIND_RADIUS + 1,
-        constants.proc.GRID_RES,
-    )
-    kIdxHighRes = range(
-        constants.proc.WIND_RADIUS,
-        binaryImage.shape[2] - constants.proc.WIND_RADIUS + 1,
-        constants.proc.GRID_RES,
-    )
+    iIdxHighRes = range(windowRadius, binaryImage.shape[0] - windowRadius + 1, gridRes)
+    jIdxHighRes = range(windowRadius, binaryImage.shape[1] - windowRadius + 1, gridRes)
+    kIdxHighRes = range(windowRadius, binaryImage.shape[2] - windowRadius + 1, gridRes)
 
     # pass moving window over binaryImage every jth voxel and calculate local topology for each window
     for i in iIdxHighRes:
@@ -228,29 +344,29 @@ def genLowResTopoMaps(binaryImage: np.ndarray, mask: np.ndarray, pixDims: np.nda
             for k in kIdxHighRes:
                 # get local binary image and mask from 3D window of input binary image
                 localBinaryImage = binaryImage[
-                    (i - constants.proc.WIND_RADIUS) : (i + constants.proc.WIND_RADIUS),
-                    (j - constants.proc.WIND_RADIUS) : (j + constants.proc.WIND_RADIUS),
-                    (k - constants.proc.WIND_RADIUS) : (k + constants.proc.WIND_RADIUS),
+                    (i - windowRadius) : (i + windowRadius),
+                    (j - windowRadius) : (j + windowRadius),
+                    (k - windowRadius) : (k + windowRadius),
                 ]
+
+                # Minkowski functionals of a window without any voxels of the binary image
+                # are all zero, which the low resolution maps are initialized to
+                if not localBinaryImage.any():
+                    continue
+
                 localMask = mask[
-                    (i - constants.proc.WIND_RADIUS) : (i + constants.proc.WIND_RADIUS),
-                    (j - constants.proc.WIND_RADIUS) : (j + constants.proc.WIND_RADIUS),
-                    (k - constants.proc.WIND_RADIUS) : (k + constants.proc.WIND_RADIUS),
+                    (i - windowRadius) : (i + windowRadius),
+                    (j - windowRadius) : (j + windowRadius),
+                    (k - windowRadius) : (k + windowRadius),
                 ]
 
                 # calculate Minkowski functionals for local binary image
                 mkFnsArray = calcMkFnsNorm(localBinaryImage, localMask, pixDims)
 
                 # calculate indices for storing local topology metrics in low resolution output maps
-                iIdxLowRes = math.ceil(
-                    (i - constants.proc.WIND_RADIUS) / constants.proc.GRID_RES
-                )
-                jIdxLowRes = math.ceil(
-                    (j - constants.proc.WIND_RADIUS) / constants.proc.GRID_RES
-                )
-                kIdxLowRes = math.ceil(
-                    (k - constants.proc.WIND_RADIUS) / constants.proc.GRID_RES
-                )
+                iIdxLowRes = math.ceil((i - windowRadius) / gridRes)
+                jIdxLowRes = math.ceil((j - windowRadius) / gridRes)
+                kIdxLowRes = math.ceil((k - windowRadius) / gridRes)
 
                 # store Minkowski functionals
                 volMap[iIdxLowRes, jIdxLowRes, kIdxLowRes] = mkFnsArray[0]
@@ -265,7 +381,10 @@ def genLowResTopoMaps(binaryImage: np.ndarray, mask: np.ndarray, pixDims: np.nda
 
 
 def resizeTopoMaps(
-    highResImgShape: tuple, mask: np.ndarray, lowResTopoMaps: np.ndarray
+    highResImgShape: tuple,
+    mask: np.ndarray,
+    lowResTopoMaps: np.ndarray,
+    windowRadius: int = constants.proc.WIND_RADIUS,
 ):
     """Use linear interpolation to resize low resolution topology maps.
 
@@ -275,6 +394,7 @@ def resizeTopoMaps(
         lowResTopoMaps (np.array): 4xnxmxp array containing normalized low resolution topology maps for
                                     volume, surface area, curvature, and Euler-Poincare characteristic
                                     (indices follow that order)
+        windowRadius (int): half the length of one side of nxnxn moving window used to make lowResTopoMaps
 
     Returns:
         highResTopoMaps (np.array): 4xnxmxp array containing masked normalized high resolution topology maps for
@@ -292,7 +412,7 @@ def resizeTopoMaps(
         # interp low res maps to specified shape, minus a border the size of the moving window radius used to make low res maps
         highResTopoMapsTmp = resize(
             lowResTopoMaps[i, :, :, :],
-            np.array(highResImgShape) - constants.proc.WIND_RADIUS * 2,
+            np.array(highResImgShape) - windowRadius * 2,
             order=1,
         )
 
@@ -300,9 +420,9 @@ def resizeTopoMaps(
         highResTopoMapsTmp = np.pad(
             highResTopoMapsTmp,
             (
-                (constants.proc.WIND_RADIUS, constants.proc.WIND_RADIUS),
-                (constants.proc.WIND_RADIUS, constants.proc.WIND_RADIUS),
-                (constants.proc.WIND_RADIUS, constants.proc.WIND_RADIUS),
+                (windowRadius, windowRadius),
+                (windowRadius, windowRadius),
+                (windowRadius, windowRadius),
             ),
             "constant",
         )
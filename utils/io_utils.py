@@ -1,9 +1,10 @@
 """Import and export util functions."""
+import hashlib
 import logging
 import os
 import shutil
 import zipfile
-from typing import Dict
+from typing import Dict, List
 
 import nibabel as nib
 import numpy as np
@@ -11,17 +12,20 @@ import pandas as pd
 import pydicom as dicom
 
 
-def readFiles(path: str):
+def readFiles(path: str, dtype=None):
     """Read in image as np.array.
 
     Args:
         path (str): path of file
+        dtype (np.dtype): optional data type to read image contents as
 
     Returns:
         outArray (np.array): image contents of file
         pixDims (np.array): pixel dimensions (in mm)
 
     If pixel dimensions available, extract them.
+    If dtype provided, image is scaled and converted directly into an array of that type,
+    avoiding an intermediate copy in the stored or float64 data type.
     Supported file formats: .nii
     """
 
@@ -43,7 +47,10 @@ def readFiles(path: str):
         pixDims = niiImg.header["pixdim"][1:4]
 
         # convert to numpy array
-        outArray = np.array(niiImg.dataobj)
+        if dtype is None:
+            outArray = np.array(niiImg.dataobj)
+        else:
+            outArray = np.asarray(niiImg.dataobj, dtype=dtype)
     else:
         logging.warning("Registered HRCT file format is unsupported, must be .nii")
 
@@ -172,3 +179,64 @@ def createMkFnDict(mkFnsArray: np.ndarray, label: str):
     mkFnsDict["euler_" + label] = mkFnsArray[3]
 
     return mkFnsDict
+
+
+def createFileCacheKey(paths: List[str], *params):
+    """Create a key identifying the contents of input files for caching derived results.
+
+    Args:
+        paths (List[str]): paths of input files
+        *params: additional parameters that the cached result depends on
+
+    Returns:
+        key (str): hex digest of file paths, modification times, and params
+
+    File contents are not read; a file is assumed unchanged if its path and
+    modification time are unchanged.
+    """
+    keyHash = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        keyHash.update(os.path.abspath(path).encode())
+        keyHash.update(str(os.stat(path).st_mtime_ns).encode())
+    for param in params:
+        keyHash.update(repr(param).encode())
+
+    return keyHash.hexdigest()
+
+
+def saveCacheArray(inArray: np.ndarray, path: str):
+    """Save np.array as .npy file for use as a cache.
+
+    Args:
+        inArray (np.array): array to be cached
+        path (str): path to save .npy file to
+
+    Array is written to a temporary file and then renamed so that an interrupted
+    write never leaves a partial cache file at path.
+    """
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        np.save(f, inArray)
+    os.replace(tmpPath, path)
+
+
+def removeStaleCacheFiles(cacheDir: str, prefix: str, keepPath: str):
+    """Remove cache files that share a prefix but were created with a different key.
+
+    Args:
+        cacheDir (str): directory containing cache files
+        prefix (str): file name prefix of cache files, followed by the cache key
+        keepPath (str): path of the current cache file, which is not removed
+
+    Only files named prefix + key + ".npy", where key contains no underscore, are
+    removed, so that a prefix ending in one subject ID never matches the files of
+    another subject whose ID starts with it.
+    """
+    for entry in os.scandir(cacheDir):
+        if not entry.name.startswith(prefix) or entry.path == keepPath:
+            continue
+        key = entry.name[len(prefix) :]
+        if key.endswith(".npy.tmp"):
+            key = key[: -len(".tmp")]
+        if key.endswith(".npy") and "_" not in key:
+            os.remove(entry.path)
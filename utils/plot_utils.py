@@ -1,5 +1,4 @@
 """Utils for plotting"""
-import pdb
 
 import matplotlib.pyplot as plt
 import numpy as np